@@ -12,18 +12,26 @@ ENV:
   DATABASE_URL         required (postgres://... or postgresql://...)
   TZ_DEFAULT           optional, default "Europe/Stockholm"
   COPY_CACHE_SECONDS   optional, default 300
+  PORT                 optional, default 8080 (webhook listener, or health endpoint when polling)
+  PUBLIC_URL           optional, https://<host>; enables webhook mode (polling when unset)
+  WEBHOOK_SECRET       optional, checked against Telegram's secret-token header in webhook mode
 """
 import asyncio
 import datetime as dt
+import functools
+import html
 import logging
 import os
-import re
-from dataclasses import dataclass
-from typing import Optional, Dict, Any, Tuple, List
+import time
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Optional, Dict, Tuple, List, Mapping
+from zoneinfo import ZoneInfo
 
 import asyncpg
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Message, Update, ReplyKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -52,14 +60,27 @@ MENU_KB = ReplyKeyboardMarkup(
     one_time_keyboard=False,
     input_field_placeholder="Choose…",
 )
+# PTB passes str reply_markup through untouched, so serialize the static
+# keyboard once instead of on every outgoing message.
+MENU_KB_JSON = MENU_KB.to_json()
 
 # ----------------------------
 # Data model
 # ----------------------------
-DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
-TIME_RE = re.compile(r"^\d{2}:\d{2}$")
+# Fixed-shape input checks (YYYY-MM-DD / HH:MM) without going through `re`.
+# _is_hhmm also range-checks (00-23 / 00-59) by comparing the ASCII digits.
+def _is_ymd(s: str) -> bool:
+    return (len(s) == 10 and s[4] == "-" and s[7] == "-" and s.isascii()
+            and s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit())
 
-@dataclass
+def _is_hhmm(s: str) -> bool:
+    return (len(s) == 5 and s[2] == ":" and s.isascii() and s[:2].isdigit() and s[3:].isdigit()
+            and s[:2] <= "23" and s[3] <= "5")
+
+def _is_uint(s: str) -> bool:
+    return s.isascii() and s.isdigit()
+
+@dataclass(slots=True)
 class UserProfile:
     chat_id: int
     partner_name: str
@@ -124,13 +145,31 @@ async def db_init():
         await conn.execute(SCHEMA_SQL)
     LOG.info("✅ DB connected + schema ensured")
 
+# Recently read/written profiles, so consecutive taps and the daily ping skip the
+# DB round trip. db_upsert_user writes through; rows edited outside the bot are
+# picked up after USER_CACHE_SECONDS. Callers get a copy they may mutate.
+USER_CACHE_SECONDS = 60
+USER_CACHE_MAX = 10000
+_user_cache: Dict[int, Tuple[float, UserProfile]] = {}
+
+def _user_cache_put(p: UserProfile) -> None:
+    now = asyncio.get_running_loop().time()
+    _user_cache.pop(p.chat_id, None)
+    _user_cache[p.chat_id] = (now, replace(p))
+    # Kept in put order, so expired entries (and past the cap, the oldest) are at the front.
+    while len(_user_cache) > USER_CACHE_MAX or now - next(iter(_user_cache.values()))[0] >= USER_CACHE_SECONDS:
+        del _user_cache[next(iter(_user_cache))]
+
 async def db_fetch_user(chat_id: int) -> Optional[UserProfile]:
+    hit = _user_cache.get(chat_id)
+    if hit and (asyncio.get_running_loop().time() - hit[0]) < USER_CACHE_SECONDS:
+        return replace(hit[1])
     assert DB_POOL
     async with DB_POOL.acquire() as conn:
         row = await conn.fetchrow("SELECT * FROM users WHERE chat_id=$1", chat_id)
         if not row:
             return None
-        return UserProfile(
+        profile = UserProfile(
             chat_id=int(row["chat_id"]),
             partner_name=row["partner_name"],
             partner_dob=row["partner_dob"].isoformat() if row["partner_dob"] else None,
@@ -141,25 +180,40 @@ async def db_fetch_user(chat_id: int) -> Optional[UserProfile]:
             tz=row["tz"],
             paused=bool(row["paused"]),
         )
+    # A write-through that landed during the await is newer than this row; keep it.
+    if _user_cache.get(chat_id) is hit:
+        _user_cache_put(profile)
+    return profile
+
+USER_UPSERT_SQL = """
+INSERT INTO users(chat_id, partner_name, partner_dob, period_start, period_end, cycle_length, notify_time, tz, paused)
+VALUES($1,$2,$3,$4,$5,$6,$7,$8,$9)
+ON CONFLICT(chat_id) DO UPDATE SET
+  partner_name=EXCLUDED.partner_name,
+  partner_dob=EXCLUDED.partner_dob,
+  period_start=EXCLUDED.period_start,
+  period_end=EXCLUDED.period_end,
+  cycle_length=EXCLUDED.cycle_length,
+  notify_time=EXCLUDED.notify_time,
+  tz=EXCLUDED.tz,
+  paused=EXCLUDED.paused,
+  updated_at=now()
+"""
 
-async def db_upsert_user(p: UserProfile) -> None:
+# Upsert + period_log append as one statement: one round trip, atomic.
+USER_UPSERT_LOG_PERIOD_SQL = f"""
+WITH u AS ({USER_UPSERT_SQL} RETURNING chat_id)
+INSERT INTO period_log(chat_id, period_start, period_end)
+SELECT chat_id, $4, $5 FROM u
+"""
+
+async def db_upsert_user(p: UserProfile, log_period: bool = False) -> None:
     assert DB_POOL
+    _render_invalidate(p.chat_id)
+    _user_cache.pop(p.chat_id, None)
     async with DB_POOL.acquire() as conn:
         await conn.execute(
-            """
-            INSERT INTO users(chat_id, partner_name, partner_dob, period_start, period_end, cycle_length, notify_time, tz, paused)
-            VALUES($1,$2,$3,$4,$5,$6,$7,$8,$9)
-            ON CONFLICT(chat_id) DO UPDATE SET
-              partner_name=EXCLUDED.partner_name,
-              partner_dob=EXCLUDED.partner_dob,
-              period_start=EXCLUDED.period_start,
-              period_end=EXCLUDED.period_end,
-              cycle_length=EXCLUDED.cycle_length,
-              notify_time=EXCLUDED.notify_time,
-              tz=EXCLUDED.tz,
-              paused=EXCLUDED.paused,
-              updated_at=now()
-            """,
+            USER_UPSERT_LOG_PERIOD_SQL if log_period else USER_UPSERT_SQL,
             p.chat_id,
             p.partner_name,
             dt.date.fromisoformat(p.partner_dob) if p.partner_dob else None,
@@ -170,16 +224,8 @@ async def db_upsert_user(p: UserProfile) -> None:
             p.tz,
             bool(p.paused),
         )
-
-async def db_log_period(chat_id: int, start_date: str, end_date: Optional[str]) -> None:
-    assert DB_POOL
-    async with DB_POOL.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO period_log(chat_id, period_start, period_end) VALUES($1,$2,$3)",
-            chat_id,
-            dt.date.fromisoformat(start_date),
-            dt.date.fromisoformat(end_date) if end_date else None,
-        )
+    _user_cache_put(p)
+    _notify_index_update(p.chat_id, p.notify_time, p.tz, p.paused)
 
 # ----------------------------
 # Copy backend (DB) with caching + fallbacks
@@ -230,22 +276,60 @@ async def copy_get(key: str, locale: str = "en", phase: Optional[str] = None) ->
 # ----------------------------
 # Cycle math (predictable MVP heuristic)
 # ----------------------------
+TZ_DEFAULT = os.getenv("TZ_DEFAULT", "Europe/Stockholm")
+
 def _default_tz() -> str:
-    return os.getenv("TZ_DEFAULT", "Europe/Stockholm")
+    return TZ_DEFAULT
 
 def _norm(s: str) -> str:
     return (s or "").strip()
 
-def _is_menu_press(text: str) -> bool:
-    return _norm(text) in MENU_TEXTS
+# ZoneInfo reads tzdata from disk on first use of a key and only keeps a few
+# instances strongly cached, so hold our own references and warm them off-loop.
+_ZONES: Dict[str, ZoneInfo] = {}
+
+def _zone(tz_name: str) -> ZoneInfo:
+    z = _ZONES.get(tz_name)
+    if z is None:
+        z = _ZONES[tz_name] = ZoneInfo(tz_name)
+    return z
+
+async def _warm_zones(names) -> None:
+    for name in set(names):
+        if name in _ZONES:
+            continue
+        try:
+            _ZONES[name] = await asyncio.to_thread(ZoneInfo, name)
+        except Exception:
+            LOG.warning("Unknown tz %r, skipping warmup", name)
+
+# Local date per tz, valid until that zone's next midnight (as a UTC timestamp),
+# so the zone conversion runs about once a day per tz instead of per render.
+_today_cache: Dict[str, Tuple[float, dt.date]] = {}
 
 def _today_in_tz(tz_name: str) -> dt.date:
-    from zoneinfo import ZoneInfo
-    return dt.datetime.now(ZoneInfo(tz_name)).date()
+    now = time.time()
+    cached = _today_cache.get(tz_name)
+    if cached and now < cached[0]:
+        return cached[1]
+    zone = _zone(tz_name)
+    today = dt.datetime.fromtimestamp(now, zone).date()
+    midnight = dt.datetime.combine(today + dt.timedelta(days=1), dt.time(), tzinfo=zone)
+    _today_cache[tz_name] = (midnight.timestamp(), today)
+    return today
+
+def _parse_ymd(s: str) -> Optional[dt.date]:
+    if not _is_ymd(s):
+        return None
+    try:
+        return dt.date.fromisoformat(s)
+    except ValueError:
+        return None
 
-def _parse_time_hhmm(s: str) -> dt.time:
-    h, m = s.split(":")
-    return dt.time(int(h), int(m))
+def _parse_time_hhmm(s: str) -> Optional[dt.time]:
+    if not _is_hhmm(s):
+        return None
+    return dt.time(int(s[:2]), int(s[3:]))
 
 def _compute_period_length(start: str, end: Optional[str]) -> int:
     if not end:
@@ -258,8 +342,16 @@ def _cycle_day_for(date_: dt.date, cycle_start: dt.date, cycle_len: int) -> int:
     delta = (date_ - cycle_start).days
     return (delta % cycle_len) + 1
 
-def _phase_boundaries(cycle_len: int, period_len: int) -> Dict[str, Tuple[int, int]]:
-    period_len = min(max(period_len, 3), 8)
+# Phases are small ints indexing into the tuples below; the lowercase key is
+# only needed for copy_strings lookups.
+MENSTRUAL, FOLLICULAR, OVULATORY, LUTEAL = range(4)
+PHASES = ("menstrual", "follicular", "ovulatory", "luteal")
+PHASE_NAME = ("Menstrual", "Follicular", "Ovulatory", "Luteal")
+PHASE_EMOJI = ("🩸", "🌱", "🔥", "🌙")
+
+# Callers pass period_len already clamped to 3..8, so the cache holds few keys.
+@functools.lru_cache(maxsize=256)
+def _phase_boundaries(cycle_len: int, period_len: int) -> Tuple[Tuple[int, int], ...]:
     ov_center = max(10, cycle_len - 14)  # rough ovulation center
     ov_start = max(period_len + 1, ov_center - 1)
     ov_end = min(cycle_len, ov_center + 1)
@@ -267,145 +359,210 @@ def _phase_boundaries(cycle_len: int, period_len: int) -> Dict[str, Tuple[int, i
     fol_end = max(fol_start, ov_start - 1)
     lut_start = ov_end + 1
     lut_end = cycle_len
-    return {
-        "menstrual": (1, period_len),
-        "follicular": (fol_start, fol_end),
-        "ovulatory": (ov_start, ov_end),
-        "luteal": (lut_start, lut_end),
-    }
-
-def _phase_for_cycle_day(day: int, bounds: Dict[str, Tuple[int,int]]) -> str:
-    for phase, (a, b) in bounds.items():
+    return (
+        (1, period_len),            # MENSTRUAL
+        (fol_start, fol_end),       # FOLLICULAR
+        (ov_start, ov_end),         # OVULATORY
+        (lut_start, lut_end),       # LUTEAL
+    )
+
+def _phase_for_cycle_day(day: int, bounds: Tuple[Tuple[int, int], ...]) -> int:
+    for phase, (a, b) in enumerate(bounds):
         if a <= day <= b:
             return phase
-    return "luteal"
-
-PHASE_NAME = {"menstrual": "Menstrual", "follicular": "Follicular", "ovulatory": "Ovulatory", "luteal": "Luteal"}
-PHASE_EMOJI = {"menstrual": "🩸", "follicular": "🌱", "ovulatory": "🔥", "luteal": "🌙"}
+    return LUTEAL
 
 def _arrow(cur: int, prev: int) -> str:
     if cur > prev: return "↗"
     if cur < prev: return "↘"
     return "→"
 
-def _phase_stats(day: int, bounds: Dict[str, Tuple[int,int]]) -> Dict[str, int]:
+# Read-only base tables; _phase_bundle copies one before adjusting it.
+_PHASE_BASE_STATS = tuple(MappingProxyType(d) for d in (
+    {"energy": 2, "mood": 2, "social": 2, "cravings": 4, "irritability": 3, "focus": 2},  # MENSTRUAL
+    {"energy": 4, "mood": 4, "social": 4, "cravings": 2, "irritability": 2, "focus": 4},  # FOLLICULAR
+    {"energy": 5, "mood": 5, "social": 5, "cravings": 2, "irritability": 1, "focus": 4},  # OVULATORY
+    {"energy": 3, "mood": 3, "social": 3, "cravings": 4, "irritability": 4, "focus": 3},  # LUTEAL
+))
+
+# Pure in (day, bounds); the cached stats mapping is shared, so it is handed out read-only.
+@functools.lru_cache(maxsize=4096)
+def _phase_bundle(day: int, bounds: Tuple[Tuple[int, int], ...]) -> Tuple[int, Mapping[str, int]]:
     phase = _phase_for_cycle_day(day, bounds)
-    if phase == "menstrual":
-        base = {"energy": 2, "mood": 2, "social": 2, "cravings": 4, "irritability": 3, "focus": 2}
-    elif phase == "follicular":
-        base = {"energy": 4, "mood": 4, "social": 4, "cravings": 2, "irritability": 2, "focus": 4}
-    elif phase == "ovulatory":
-        base = {"energy": 5, "mood": 5, "social": 5, "cravings": 2, "irritability": 1, "focus": 4}
-    else:
-        base = {"energy": 3, "mood": 3, "social": 3, "cravings": 4, "irritability": 4, "focus": 3}
+    base = dict(_PHASE_BASE_STATS[phase])
 
     a, b = bounds[phase]
     span = max(1, b - a)
     t = (day - a) / span
 
-    if phase == "follicular" and t > 0.6:
+    if phase == FOLLICULAR and t > 0.6:
         base["energy"] = min(5, base["energy"] + 1)
-    if phase == "luteal" and t > 0.6:
+    if phase == LUTEAL and t > 0.6:
         base["mood"] = max(1, base["mood"] - 1)
         base["focus"] = max(1, base["focus"] - 1)
         base["irritability"] = min(5, base["irritability"] + 1)
-    if phase == "menstrual" and t < 0.3:
+    if phase == MENSTRUAL and t < 0.3:
         base["energy"] = max(1, base["energy"] - 1)
 
-    return base
+    return phase, MappingProxyType(base)
+
+# Profile dates only change on edits; parse them and derive phase bounds once per distinct value.
+@functools.lru_cache(maxsize=4096)
+def _cycle_setup(period_start: str, period_end: Optional[str], cycle_len: int) -> Tuple[dt.date, Tuple[Tuple[int, int], ...]]:
+    period_len = min(max(_compute_period_length(period_start, period_end), 3), 8)
+    return dt.date.fromisoformat(period_start), _phase_boundaries(cycle_len, period_len)
+
+# One (phase, forecast line tail) per cycle day; render_forecast just indexes into it.
+@functools.lru_cache(maxsize=256)
+def _forecast_table(cycle_len: int, bounds: Tuple[Tuple[int, int], ...]) -> Tuple[Tuple[int, str], ...]:
+    rows = []
+    for cd in range(1, cycle_len + 1):
+        ph, st = _phase_bundle(cd, bounds)
+        rows.append((
+            ph,
+            f"Day {cd}/{cycle_len} · {PHASE_NAME[ph]} {PHASE_EMOJI[ph]} "
+            f"⚡{st['energy']} 🎭{st['mood']} 🗣️{st['social']} 🍫{st['cravings']}",
+        ))
+    return tuple(rows)
+
+_BARS = tuple("▰" * n + "▱" * (5 - n) for n in range(6))
 
 def _bar(level: int) -> str:
-    level = max(1, min(5, level))
-    return "▰" * level + "▱" * (5 - level)
+    return _BARS[max(1, min(5, level))]
+
+# (stat key, line prefix) in card order.
+_STAT_ROWS = (
+    ("energy", "⚡ Energy: "),
+    ("mood", "🎭 Mood: "),
+    ("social", "🗣️ Social: "),
+    ("cravings", "🍫 Cravings: "),
+    ("irritability", "💢 Irritability: "),
+    ("focus", "🧠 Focus: "),
+)
 
 # ----------------------------
 # Rendering
 # ----------------------------
+# Rendered cards per (kind, chat_id). An entry is reused only for the same local
+# date and profile fields, and expires with the copy cache so DB copy edits show up.
+# Up to three cards per chat, so the cap tracks the user cache's.
+RENDER_CACHE_MAX = 3 * USER_CACHE_MAX
+_render_cache: Dict[Tuple[str, int], Tuple[float, Tuple, str]] = {}
+
+def _render_stamp(profile: UserProfile, today: dt.date, *extra) -> Tuple:
+    return (today, profile.partner_name, profile.period_start, profile.period_end,
+            profile.cycle_length, profile.notify_time, profile.tz) + extra
+
+def _render_cached(kind: str, chat_id: int, stamp: Tuple) -> Optional[str]:
+    hit = _render_cache.get((kind, chat_id))
+    if hit and hit[1] == stamp and (asyncio.get_running_loop().time() - hit[0]) < COPY_CACHE_SECONDS:
+        return hit[2]
+    return None
+
+def _render_store(kind: str, chat_id: int, stamp: Tuple, text: str) -> str:
+    now = asyncio.get_running_loop().time()
+    _render_cache.pop((kind, chat_id), None)
+    _render_cache[(kind, chat_id)] = (now, stamp, text)
+    # Kept in put order, so expired entries (and past the cap, the oldest) are at the front.
+    while len(_render_cache) > RENDER_CACHE_MAX or now - next(iter(_render_cache.values()))[0] >= COPY_CACHE_SECONDS:
+        del _render_cache[next(iter(_render_cache))]
+    return text
+
+def _render_invalidate(chat_id: int) -> None:
+    for kind in ("today", "forecast", "about"):
+        _render_cache.pop((kind, chat_id), None)
+
+# STATS rows (bar + trend vs the previous cycle day) depend only on the cycle day
+# and bounds, so each distinct block is formatted once.
+@functools.lru_cache(maxsize=4096)
+def _stats_block(day: int, cycle_len: int, bounds: Tuple[Tuple[int, int], ...]) -> str:
+    _, now_stats = _phase_bundle(day, bounds)
+    _, prev_stats = _phase_bundle(day - 1 if day > 1 else cycle_len, bounds)
+    return "\n".join(
+        f"{prefix}{_bar(now_stats[k])} {_arrow(now_stats[k], prev_stats[k])}" for k, prefix in _STAT_ROWS
+    )
+
 async def render_today(profile: UserProfile) -> str:
     tz = profile.tz
     today = _today_in_tz(tz)
+    stamp = _render_stamp(profile, today)
+    cached = _render_cached("today", profile.chat_id, stamp)
+    if cached is not None:
+        return cached
 
-    start = dt.date.fromisoformat(profile.period_start)
-    period_len = _compute_period_length(profile.period_start, profile.period_end)
-    bounds = _phase_boundaries(profile.cycle_length, period_len)
+    start, bounds = _cycle_setup(profile.period_start, profile.period_end, profile.cycle_length)
 
     day = _cycle_day_for(today, start, profile.cycle_length)
-    phase = _phase_for_cycle_day(day, bounds)
+    phase, _ = _phase_bundle(day, bounds)
     pa, pb = bounds[phase]
     phase_pos = day - pa + 1
     phase_total = pb - pa + 1
 
-    yday = today - dt.timedelta(days=1)
-    yday_num = _cycle_day_for(yday, start, profile.cycle_length)
-    now_stats = _phase_stats(day, bounds)
-    prev_stats = _phase_stats(yday_num, bounds)
-
-    def stat_line(label: str, emoji: str, key: str):
-        return f"{emoji} {label}: {_bar(now_stats[key])} {_arrow(now_stats[key], prev_stats[key])}"
+    stats_block = _stats_block(day, profile.cycle_length, bounds)
 
-    help_text = await copy_get(f"help_{phase}", phase=phase)
+    help_text = await copy_get(f"help_{PHASES[phase]}", phase=PHASES[phase])
 
     # Next phase change within current cycle
     next_change = None
     next_phase = None
-    for ph, (a, b) in bounds.items():
-        if ph == phase:
-            if b < profile.cycle_length:
-                delta = (b + 1) - day
-                next_change = today + dt.timedelta(days=delta)
-                next_phase = _phase_for_cycle_day(b + 1, bounds)
-            break
+    if pb < profile.cycle_length:
+        next_change = today + dt.timedelta(days=(pb + 1) - day)
+        next_phase = _phase_for_cycle_day(pb + 1, bounds)
 
     change_txt = ""
-    if next_change and next_phase and next_phase != phase:
+    if next_change and next_phase is not None and next_phase != phase:
         change_txt = f"\n\n⏭ Next change: <b>{next_change.isoformat()}</b> - {PHASE_NAME[next_phase]} {PHASE_EMOJI[next_phase]}"
 
-    return (
-        f"<b>TODAY: {profile.partner_name}</b>\n"
+    text = (
+        f"<b>TODAY: {html.escape(profile.partner_name)}</b>\n"
         f"Cycle day: <b>{day}/{profile.cycle_length}</b>\n"
         f"Phase: <b>{PHASE_NAME[phase]}</b> ({phase_pos}/{phase_total}) {PHASE_EMOJI[phase]}\n"
         f"Daily ping: <b>{profile.notify_time}</b> ({tz})\n\n"
         f"<b>STATS</b>\n"
-        f"{stat_line('Energy', '⚡', 'energy')}\n"
-        f"{stat_line('Mood', '🎭', 'mood')}\n"
-        f"{stat_line('Social', '🗣️', 'social')}\n"
-        f"{stat_line('Cravings', '🍫', 'cravings')}\n"
-        f"{stat_line('Irritability', '💢', 'irritability')}\n"
-        f"{stat_line('Focus', '🧠', 'focus')}\n\n"
+        f"{stats_block}\n\n"
         f"<b>🫶 How to help</b>\n"
         f"• {help_text}"
         f"{change_txt}"
     )
+    return _render_store("today", profile.chat_id, stamp, text)
 
 async def render_about_phase(profile: UserProfile) -> str:
     tz = profile.tz
     today = _today_in_tz(tz)
+    stamp = _render_stamp(profile, today)
+    cached = _render_cached("about", profile.chat_id, stamp)
+    if cached is not None:
+        return cached
 
-    start = dt.date.fromisoformat(profile.period_start)
-    period_len = _compute_period_length(profile.period_start, profile.period_end)
-    bounds = _phase_boundaries(profile.cycle_length, period_len)
+    start, bounds = _cycle_setup(profile.period_start, profile.period_end, profile.cycle_length)
     day = _cycle_day_for(today, start, profile.cycle_length)
     phase = _phase_for_cycle_day(day, bounds)
 
-    desc = await copy_get(f"phase_desc_{phase}", phase=phase)
-    return f"<b>About phase: {PHASE_NAME[phase]} {PHASE_EMOJI[phase]}</b>\n\n{desc}"
+    desc = await copy_get(f"phase_desc_{PHASES[phase]}", phase=PHASES[phase])
+    text = f"<b>About phase: {PHASE_NAME[phase]} {PHASE_EMOJI[phase]}</b>\n\n{desc}"
+    return _render_store("about", profile.chat_id, stamp, text)
 
 async def render_forecast(profile: UserProfile, days: int = 7) -> str:
     tz = profile.tz
     today = _today_in_tz(tz)
+    stamp = _render_stamp(profile, today, days)
+    cached = _render_cached("forecast", profile.chat_id, stamp)
+    if cached is not None:
+        return cached
 
-    start = dt.date.fromisoformat(profile.period_start)
-    period_len = _compute_period_length(profile.period_start, profile.period_end)
-    bounds = _phase_boundaries(profile.cycle_length, period_len)
+    start, bounds = _cycle_setup(profile.period_start, profile.period_end, profile.cycle_length)
 
-    lines = [f"<b>Forecast: next {days} days</b> ({profile.partner_name})\n"]
+    cycle_len = profile.cycle_length
+    table = _forecast_table(cycle_len, bounds)
+    base = _cycle_day_for(today, start, cycle_len) - 1
+
+    lines = [f"<b>Forecast: next {days} days</b> ({html.escape(profile.partner_name)})\n"]
     last_phase = None
     change_points: List[str] = []
 
     for i in range(days):
         d = today + dt.timedelta(days=i)
-        cd = _cycle_day_for(d, start, profile.cycle_length)
-        ph = _phase_for_cycle_day(cd, bounds)
+        ph, tail = table[(base + i) % cycle_len]
 
         if last_phase is None:
             last_phase = ph
@@ -413,186 +570,193 @@ async def render_forecast(profile: UserProfile, days: int = 7) -> str:
             change_points.append(f"• {d.isoformat()} - switches to {PHASE_NAME[ph]} {PHASE_EMOJI[ph]}")
             last_phase = ph
 
-        st = _phase_stats(cd, bounds)
-        lines.append(
-            f"{d.isoformat()} · Day {cd}/{profile.cycle_length} · {PHASE_NAME[ph]} {PHASE_EMOJI[ph]} "
-            f"⚡{st['energy']} 🎭{st['mood']} 🗣️{st['social']} 🍫{st['cravings']}"
-        )
+        lines.append(f"{d.isoformat()} · {tail}")
 
     lines.append("\n<b>Important change points</b>")
     lines.append("\n".join(change_points) if change_points else "• No phase switch within this window.")
-    return "\n".join(lines)
+    return _render_store("forecast", profile.chat_id, stamp, "\n".join(lines))
 
 # ----------------------------
 # Telegram send helper
 # ----------------------------
-async def _send(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
-    if update.message:
-        await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=MENU_KB)
-    else:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=text, parse_mode=ParseMode.HTML, reply_markup=MENU_KB)
+# Handlers only ever receive message updates (see allowed_updates in main),
+# so they bind update.message once and reply through it.
+async def _reply(msg: Message, text: str):
+    await msg.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=MENU_KB_JSON)
 
 # ----------------------------
 # Onboarding (menu always visible + menu presses don't break steps)
 # ----------------------------
 (O_NICK, O_DOB, O_START, O_END, O_CYCLE, O_TIME) = range(6)
 
+# Step prompts, plus the "finish first" replies built from them once at import.
+_STEP_PROMPT = {
+    O_NICK: "1/6 - Enter partner nickname (example: Anna)",
+    O_DOB: "2/6 - Partner DOB (YYYY-MM-DD) or type <b>skip</b>",
+    O_START: "3/6 - Last period START date (YYYY-MM-DD)",
+    O_END: "4/6 - Last period END date (YYYY-MM-DD) or type <b>skip</b>",
+    O_CYCLE: "5/6 - Cycle length in days (21-35). Example: 28",
+    O_TIME: "6/6 - Daily notification time (HH:MM). Example: 09:00",
+}
+_FINISH_FIRST = {state: "Finish onboarding first 🙂\n\n" + prompt for state, prompt in _STEP_PROMPT.items()}
+_WELCOME = "Welcome 👋\n\n<b>Quick onboarding</b>\n\n" + _STEP_PROMPT[O_NICK]
+_INVALID_DOB = "Invalid date.\n\n" + _STEP_PROMPT[O_DOB]
+_INVALID_START = "Invalid date.\n\n" + _STEP_PROMPT[O_START]
+_INVALID_END = "Invalid date.\n\n" + _STEP_PROMPT[O_END]
+
+def _finish_first(state: int):
+    # Menu taps mid-onboarding get the current step repeated instead of breaking the flow.
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await _reply(update.message, _FINISH_FIRST[state])
+        return state
+    return handler
+
 async def start_onboarding(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await _send(update, context,
-        "Welcome 👋\n\n"
-        "<b>Quick onboarding</b>\n\n"
-        "1/6 - Enter partner nickname (example: Anna)"
-    )
+    msg = update.message
+    await _reply(msg, _WELCOME)
     return O_NICK
 
 async def o_nick(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n1/6 - Enter partner nickname (example: Anna)")
-        return O_NICK
-    nick = _norm(update.message.text)
+    msg = update.message
+    nick = _norm(msg.text)
     if len(nick) < 2:
-        await _send(update, context, "Nickname too short.\n\n1/6 - Enter partner nickname (2+ letters)")
+        await _reply(msg, "Nickname too short.\n\n1/6 - Enter partner nickname (2+ letters)")
         return O_NICK
     context.user_data["partner_name"] = nick
-    await _send(update, context, "2/6 - Partner DOB (YYYY-MM-DD) or type <b>skip</b>")
+    await _reply(msg, _STEP_PROMPT[O_DOB])
     return O_DOB
 
 async def o_dob(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n2/6 - Partner DOB (YYYY-MM-DD) or type <b>skip</b>")
-        return O_DOB
-    t = _norm(update.message.text).lower()
+    msg = update.message
+    t = _norm(msg.text).lower()
     if t == "skip":
         context.user_data["partner_dob"] = None
     else:
-        if not DATE_RE.match(t):
-            await _send(update, context, "Invalid date.\n\n2/6 - Partner DOB (YYYY-MM-DD) or type <b>skip</b>")
+        if _parse_ymd(t) is None:
+            await _reply(msg, _INVALID_DOB)
             return O_DOB
-        dt.date.fromisoformat(t)
         context.user_data["partner_dob"] = t
-    await _send(update, context, "3/6 - Last period START date (YYYY-MM-DD)")
+    await _reply(msg, _STEP_PROMPT[O_START])
     return O_START
 
 async def o_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n3/6 - Last period START date (YYYY-MM-DD)")
-        return O_START
-    t = _norm(update.message.text)
-    if not DATE_RE.match(t):
-        await _send(update, context, "Invalid date.\n\n3/6 - Last period START date (YYYY-MM-DD)")
+    msg = update.message
+    t = _norm(msg.text)
+    if _parse_ymd(t) is None:
+        await _reply(msg, _INVALID_START)
         return O_START
-    dt.date.fromisoformat(t)
     context.user_data["period_start"] = t
-    await _send(update, context, "4/6 - Last period END date (YYYY-MM-DD) or type <b>skip</b>")
+    await _reply(msg, _STEP_PROMPT[O_END])
     return O_END
 
 async def o_end(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n4/6 - Last period END date (YYYY-MM-DD) or type <b>skip</b>")
-        return O_END
-    t = _norm(update.message.text).lower()
+    msg = update.message
+    t = _norm(msg.text).lower()
     if t == "skip":
         context.user_data["period_end"] = None
     else:
-        if not DATE_RE.match(t):
-            await _send(update, context, "Invalid date.\n\n4/6 - Last period END date (YYYY-MM-DD) or type <b>skip</b>")
+        end = _parse_ymd(t)
+        if end is None:
+            await _reply(msg, _INVALID_END)
             return O_END
-        end = dt.date.fromisoformat(t)
         start = dt.date.fromisoformat(context.user_data["period_start"])
         if end < start:
-            await _send(update, context, "End date can't be before start date.\n\n4/6 - Try again (YYYY-MM-DD)")
+            await _reply(msg, "End date can't be before start date.\n\n4/6 - Try again (YYYY-MM-DD)")
             return O_END
         context.user_data["period_end"] = t
-    await _send(update, context, "5/6 - Cycle length in days (21-35). Example: 28")
+    await _reply(msg, _STEP_PROMPT[O_CYCLE])
     return O_CYCLE
 
 async def o_cycle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n5/6 - Cycle length in days (21-35). Example: 28")
-        return O_CYCLE
-    t = _norm(update.message.text)
-    if not t.isdigit():
-        await _send(update, context, "Enter a number 21-35.\n\n5/6 - Cycle length in days (21-35).")
+    msg = update.message
+    t = _norm(msg.text)
+    if not _is_uint(t):
+        await _reply(msg, "Enter a number 21-35.\n\n5/6 - Cycle length in days (21-35).")
         return O_CYCLE
     n = int(t)
     if n < 21 or n > 35:
-        await _send(update, context, "Enter a number 21-35.\n\n5/6 - Cycle length in days (21-35).")
+        await _reply(msg, "Enter a number 21-35.\n\n5/6 - Cycle length in days (21-35).")
         return O_CYCLE
     context.user_data["cycle_length"] = n
-    await _send(update, context, "6/6 - Daily notification time (HH:MM). Example: 09:00")
+    await _reply(msg, _STEP_PROMPT[O_TIME])
     return O_TIME
 
 async def o_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if _is_menu_press(update.message.text):
-        await _send(update, context, "Finish onboarding first 🙂\n\n6/6 - Daily notification time (HH:MM). Example: 09:00")
-        return O_TIME
-    t = _norm(update.message.text)
-    if not TIME_RE.match(t):
-        await _send(update, context, "Time format should be HH:MM (24h).\n\n6/6 - Daily notification time (HH:MM).")
+    msg = update.message
+    t = _norm(msg.text)
+    if _parse_time_hhmm(t) is None:
+        await _reply(msg, "Time format should be HH:MM (24h).\n\n6/6 - Daily notification time (HH:MM).")
         return O_TIME
-    _parse_time_hhmm(t)
 
     chat_id = update.effective_chat.id
+    ud = context.user_data
     profile = UserProfile(
         chat_id=chat_id,
-        partner_name=context.user_data["partner_name"],
-        partner_dob=context.user_data.get("partner_dob"),
-        period_start=context.user_data["period_start"],
-        period_end=context.user_data.get("period_end"),
-        cycle_length=int(context.user_data["cycle_length"]),
+        partner_name=ud["partner_name"],
+        partner_dob=ud.get("partner_dob"),
+        period_start=ud["period_start"],
+        period_end=ud.get("period_end"),
+        cycle_length=int(ud["cycle_length"]),
         notify_time=t,
         tz=_default_tz(),
         paused=False,
     )
 
-    await db_upsert_user(profile)
-    await db_log_period(chat_id, profile.period_start, profile.period_end)
-    context.user_data.clear()
+    await db_upsert_user(profile, log_period=True)
+    ud.clear()
 
     # ✅ Critical: show TODAY immediately with menu
-    await _send(update, context, "✅ Saved.\n\n" + await render_today(profile))
+    await _reply(msg, "✅ Saved.\n\n" + await render_today(profile))
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     context.user_data.clear()
-    await _send(update, context, "Onboarding cancelled.")
+    await _reply(msg, "Onboarding cancelled.")
     return ConversationHandler.END
 
 # ----------------------------
 # Commands + menu
 # ----------------------------
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
+        # (Re)entering the conversation at O_NICK: drop answers from an abandoned run.
+        context.user_data.clear()
         return await start_onboarding(update, context)
-    await _send(update, context, await render_today(profile))
+    await _reply(msg, await render_today(profile))
 
 async def cmd_today(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    await _send(update, context, await render_today(profile))
+    await _reply(msg, await render_today(profile))
 
 async def cmd_forecast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    await _send(update, context, await render_forecast(profile, 7))
+    await _reply(msg, await render_forecast(profile, 7))
 
 async def cmd_about(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    await _send(update, context, await render_about_phase(profile))
+    await _reply(msg, await render_about_phase(profile))
 
 async def cmd_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    await _send(
-        update, context,
+    await _reply(
+        msg,
         "<b>Settings</b>\n\n"
-        f"Partner: <b>{profile.partner_name}</b>\n"
+        f"Partner: <b>{html.escape(profile.partner_name)}</b>\n"
         f"Period: <b>{profile.period_start}</b> → <b>{profile.period_end or 'unknown'}</b>\n"
         f"Cycle: <b>{profile.cycle_length}</b>\n"
         f"Notify: <b>{profile.notify_time}</b> ({profile.tz})\n"
@@ -609,100 +773,243 @@ async def cmd_re_onboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await start_onboarding(update, context)
 
 async def cmd_pause(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
     profile.paused = True
     await db_upsert_user(profile)
-    await _send(update, context, "⏸ Paused daily pings.\n\n" + await render_today(profile))
+    await _reply(msg, "⏸ Paused daily pings.\n\n" + await render_today(profile))
 
 async def cmd_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
     profile.paused = False
     await db_upsert_user(profile)
-    await _send(update, context, "▶️ Resumed daily pings.\n\n" + await render_today(profile))
+    await _reply(msg, "▶️ Resumed daily pings.\n\n" + await render_today(profile))
 
 async def cmd_set_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    parts = (update.message.text or "").split()
-    if len(parts) != 2 or not TIME_RE.match(parts[1]):
-        return await _send(update, context, "Usage: /set_time HH:MM")
-    _parse_time_hhmm(parts[1])
+    parts = (msg.text or "").split()
+    if len(parts) != 2 or _parse_time_hhmm(parts[1]) is None:
+        return await _reply(msg, "Usage: /set_time HH:MM")
     profile.notify_time = parts[1]
     await db_upsert_user(profile)
-    await _send(update, context, "✅ Updated.\n\n" + await render_today(profile))
+    await _reply(msg, "✅ Updated.\n\n" + await render_today(profile))
 
 async def cmd_set_cycle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    parts = (update.message.text or "").split()
-    if len(parts) != 2 or not parts[1].isdigit():
-        return await _send(update, context, "Usage: /set_cycle 21-35")
+    parts = (msg.text or "").split()
+    if len(parts) != 2 or not _is_uint(parts[1]):
+        return await _reply(msg, "Usage: /set_cycle 21-35")
     n = int(parts[1])
     if n < 21 or n > 35:
-        return await _send(update, context, "Cycle length should be 21-35.")
+        return await _reply(msg, "Cycle length should be 21-35.")
     profile.cycle_length = n
     await db_upsert_user(profile)
-    await _send(update, context, "✅ Updated.\n\n" + await render_today(profile))
+    await _reply(msg, "✅ Updated.\n\n" + await render_today(profile))
 
 async def cmd_update_period(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg = update.message
     profile = await db_fetch_user(update.effective_chat.id)
     if not profile:
         return await start_onboarding(update, context)
-    parts = (update.message.text or "").split()
+    parts = (msg.text or "").split()
     if len(parts) not in (2, 3):
-        return await _send(update, context, "Usage: /update_period START [END]")
+        return await _reply(msg, "Usage: /update_period START [END]")
     start_s = parts[1]
     end_s = parts[2] if len(parts) == 3 else None
 
-    if not DATE_RE.match(start_s) or (end_s and not DATE_RE.match(end_s)):
-        return await _send(update, context, "Dates must be YYYY-MM-DD.")
-    s = dt.date.fromisoformat(start_s)
-    if end_s:
-        e = dt.date.fromisoformat(end_s)
-        if e < s:
-            return await _send(update, context, "END cannot be before START.")
+    s = _parse_ymd(start_s)
+    e = _parse_ymd(end_s) if end_s else None
+    if s is None or (end_s and e is None):
+        return await _reply(msg, "Dates must be YYYY-MM-DD.")
+    if e and e < s:
+        return await _reply(msg, "END cannot be before START.")
 
     profile.period_start = start_s
     profile.period_end = end_s
-    await db_upsert_user(profile)
-    await db_log_period(profile.chat_id, start_s, end_s)
-    await _send(update, context, "✅ Period updated.\n\n" + await render_today(profile))
+    await db_upsert_user(profile, log_period=True)
+    await _reply(msg, "✅ Period updated.\n\n" + await render_today(profile))
+
+# Button labels plus the bare words people type instead of tapping.
+_MENU_ROUTES = {
+    BTN_TODAY: cmd_today,
+    BTN_FORECAST: cmd_forecast,
+    BTN_SETTINGS: cmd_settings,
+    BTN_ABOUT: cmd_about,
+    "today": cmd_today,
+    "forecast": cmd_forecast,
+    "settings": cmd_settings,
+    "about": cmd_about,
+}
 
 async def on_menu_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    t = _norm(update.message.text)
-    if t == BTN_TODAY:
-        return await cmd_today(update, context)
-    if t == BTN_FORECAST:
-        return await cmd_forecast(update, context)
-    if t == BTN_SETTINGS:
-        return await cmd_settings(update, context)
-    if t == BTN_ABOUT:
-        return await cmd_about(update, context)
-    await _send(update, context, "Use the menu buttons, or type /start.")
+    msg = update.message
+    t = _norm(msg.text)
+    route = _MENU_ROUTES.get(t) or _MENU_ROUTES.get(t.lower())
+    if route:
+        return await route(update, context)
+    await _reply(msg, "Use the menu buttons, or type /start.")
 
 # ----------------------------
 # Notifications loop (no job-queue)
 # ----------------------------
+# Caps in-flight outbound pings; _send_pace spaces their starts so a large bucket
+# stays under Telegram's ~30 msg/s bot-wide limit however fast each send returns.
+_SEND_SEM = asyncio.Semaphore(25)
+_SEND_INTERVAL = 1 / 28
+_send_next_at = 0.0
+
+async def _send_pace() -> None:
+    global _send_next_at
+    now = asyncio.get_running_loop().time()
+    at = max(now, _send_next_at)
+    _send_next_at = at + _SEND_INTERVAL
+    if at > now:
+        await asyncio.sleep(at - now)
+
 async def _send_daily_ping(app: Application, profile: UserProfile):
-    try:
-        await app.bot.send_message(
-            chat_id=profile.chat_id,
-            text=await render_today(profile),
-            parse_mode=ParseMode.HTML,
-            reply_markup=MENU_KB,
-        )
-    except Exception:
-        LOG.exception("Failed sending ping to chat_id=%s", profile.chat_id)
+    text = await render_today(profile)
+    async with _SEND_SEM:
+        try:
+            try:
+                await _send_pace()
+                await app.bot.send_message(
+                    chat_id=profile.chat_id,
+                    text=text,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=MENU_KB_JSON,
+                )
+            except RetryAfter as e:
+                LOG.warning("Flood control on chat_id=%s, retrying in %ss", profile.chat_id, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                await _send_pace()
+                await app.bot.send_message(
+                    chat_id=profile.chat_id,
+                    text=text,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=MENU_KB_JSON,
+                )
+        except Exception:
+            LOG.exception("Failed sending ping to chat_id=%s", profile.chat_id)
+
+# Unpaused users bucketed by tz -> minute of day -> chat_ids, so a tick only touches
+# chats that are due. Kept in step by db_upsert_user and resynced from the DB
+# every NOTIFY_RESYNC_SECONDS to pick up rows edited outside the bot.
+NOTIFY_RESYNC_SECONDS = 3600
+_notify_index: Dict[str, Dict[int, set]] = {}
+_notify_slot: Dict[int, Tuple[str, int]] = {}
+# Wakes notification_loop early when the index changes.
+_notify_changed = asyncio.Event()
+# asyncio may fire a timer up to one clock tick early; pad sleeps by that much.
+_CLOCK_PAD = time.get_clock_info("monotonic").resolution
+# A paced fan-out can run past a minute boundary; the next pass re-checks the
+# minutes it ran past (up to this far back) so those buckets aren't skipped.
+NOTIFY_CATCHUP = dt.timedelta(minutes=15)
+_MINUTE = dt.timedelta(minutes=1)
+# chat_id -> UTC time its slot last moved. A chat moved after a minute ended
+# isn't due for it on backfill: it was set to a time that had already passed.
+_notify_moved: Dict[int, dt.datetime] = {}
+
+# notify_time stays "HH:MM" (DB column + display); there are only 1440 valid
+# values, so the parse to minute-of-day is memoized for index loads/resyncs.
+@functools.lru_cache(maxsize=2048)
+def _notify_minute(notify_time: str) -> Optional[int]:
+    t = _parse_time_hhmm(notify_time)
+    return None if t is None else t.hour * 60 + t.minute
+
+def _notify_index_update(chat_id: int, notify_time: str, tz: Optional[str], paused: bool) -> None:
+    old = _notify_slot.pop(chat_id, None)
+    if old:
+        by_time = _notify_index.get(old[0], {})
+        bucket = by_time.get(old[1])
+        if bucket is not None:
+            bucket.discard(chat_id)
+            if not bucket:
+                del by_time[old[1]]
+                if not by_time:
+                    del _notify_index[old[0]]
+    minute = _notify_minute(notify_time)
+    slot = None
+    if not paused and minute is not None:
+        slot = (tz or _default_tz(), minute)
+        # The scan resolves every indexed zone, so one bad tz key would stop all pings;
+        # leave such a chat out (its cards can't render either) until the row is fixed.
+        try:
+            _zone(slot[0])
+        except Exception:
+            LOG.warning("Unknown tz %r for chat_id=%s, not scheduling pings", slot[0], chat_id)
+            slot = None
+    if slot is None:
+        _notify_moved.pop(chat_id, None)
+    else:
+        _notify_index.setdefault(slot[0], {}).setdefault(slot[1], set()).add(chat_id)
+        _notify_slot[chat_id] = slot
+        if slot != old:
+            _notify_moved[chat_id] = dt.datetime.now(dt.timezone.utc)
+    _notify_changed.set()
+
+def _slot_utc(day: dt.date, t: dt.time, zone: ZoneInfo, fold: int) -> dt.datetime:
+    return dt.datetime.combine(day, t, tzinfo=zone).replace(fold=fold).astimezone(dt.timezone.utc)
+
+def _next_notify_at(now_utc: dt.datetime) -> Optional[dt.datetime]:
+    # Recomputed from each zone's wall-clock date + HH:MM, so DST shifts are honoured.
+    # Candidates are compared in UTC: aware datetimes sharing a tzinfo compare by
+    # wall time and ignore fold, which breaks on fall-back nights when a local
+    # time occurs twice. Both folds of today are tried, then tomorrow.
+    this_minute = now_utc.replace(second=0, microsecond=0)
+    best = None
+    for tz, by_time in _notify_index.items():
+        zone = _zone(tz)
+        today = now_utc.astimezone(zone).date()
+        tomorrow = today + dt.timedelta(days=1)
+        for minute in by_time:
+            t = dt.time(minute // 60, minute % 60)
+            at = min(
+                (c for c in (_slot_utc(d, t, zone, f) for d, f in ((today, 0), (today, 1), (tomorrow, 0)))
+                 if c > this_minute),
+                default=None,
+            )
+            if at is not None and (best is None or at < best):
+                best = at
+    return best
+
+async def _notify_index_load() -> None:
+    assert DB_POOL
+    async with DB_POOL.acquire() as conn:
+        rows = await conn.fetch("SELECT chat_id, notify_time, tz FROM users WHERE paused = FALSE")
+    # Warm first so _notify_index_update resolves zones without reading tzdata on the loop.
+    await _warm_zones(r["tz"] or _default_tz() for r in rows)
+    # Update in place rather than rebuild, so unchanged slots keep their _notify_moved stamp.
+    seen = set()
+    for r in rows:
+        chat_id = int(r["chat_id"])
+        seen.add(chat_id)
+        _notify_index_update(chat_id, r["notify_time"], r["tz"], False)
+    for chat_id in [c for c in _notify_slot if c not in seen]:
+        _notify_index_update(chat_id, "", None, True)
+
+async def _ping_due(app: Application, chat_id: int, local_day: int, sent_today: Dict[int, int]):
+    profile = await db_fetch_user(chat_id)
+    if profile and not profile.paused:
+        await _send_daily_ping(app, profile)
+        sent_today[chat_id] = local_day
 
 async def notification_loop(app: Application):
-    sent_today: Dict[int, str] = {}
-    from zoneinfo import ZoneInfo
+    # chat_id -> local date ordinal of the last ping sent.
+    sent_today: Dict[int, int] = {}
+    loaded_at = None
+    # Minutes the last fan-out ran past, for the next pass to backfill.
+    ran_past: List[dt.datetime] = []
 
     while True:
         try:
@@ -710,46 +1017,130 @@ async def notification_loop(app: Application):
                 await asyncio.sleep(2)
                 continue
 
-            async with DB_POOL.acquire() as conn:
-                rows = await conn.fetch(
-                    "SELECT chat_id, notify_time, tz, paused FROM users"
-                )
-
-            now_utc = dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc)
-
-            for r in rows:
-                if bool(r["paused"]):
-                    continue
-
-                chat_id = int(r["chat_id"])
-                notify_time = r["notify_time"]
-             if bool(r["paused"]):
-    continue
-tz = r["tz"] or os.getenv("TZ_DEFAULT", "Europe/Stockholm")
-
-                local_now = now_utc.astimezone(ZoneInfo(tz))
-                local_date = local_now.date().isoformat()
-                hhmm = f"{local_now.hour:02d}:{local_now.minute:02d}"
-
-                if hhmm == notify_time and sent_today.get(chat_id) != local_date:
-                    profile = await db_fetch_user(chat_id)
-                    if profile:
-                        await _send_daily_ping(app, profile)
-                        sent_today[chat_id] = local_date
+            loop_now = asyncio.get_running_loop().time()
+            if loaded_at is None or (loop_now - loaded_at) >= NOTIFY_RESYNC_SECONDS:
+                await _notify_index_load()
+                loaded_at = loop_now
+            _notify_changed.clear()
+
+            now_utc = dt.datetime.now(dt.timezone.utc)
+            this_minute = now_utc.replace(second=0, microsecond=0)
+            # Backfill the minutes the last fan-out ran past (edits made during a send
+            # can land in them, and sent_today absorbs repeats), then this minute.
+            minutes = [m for m in ran_past if m < this_minute] + [this_minute]
+            moved = dict(_notify_moved)
+            _notify_moved.clear()
+
+            # chat_id -> local date ordinal; a dict so a chat seen in two scanned
+            # minutes (DST fall-back repeats local times) is only pinged once.
+            due_now: Dict[int, int] = {}
+            for minute in minutes:
+                ended = minute + _MINUTE
+                for tz, by_time in _notify_index.items():
+                    local = minute.astimezone(_zone(tz))
+                    due = by_time.get(local.hour * 60 + local.minute)
+                    if not due:
+                        continue
+                    local_day = local.toordinal()
+                    for chat_id in due:
+                        if sent_today.get(chat_id) == local_day:
+                            continue
+                        at = moved.get(chat_id)
+                        if at is None or at < ended:
+                            due_now[chat_id] = local_day
+
+            # Fan out; _SEND_SEM and _send_pace keep the burst under Telegram's rate limit.
+            results = await asyncio.gather(
+                *(_ping_due(app, chat_id, local_day, sent_today) for chat_id, local_day in due_now.items()),
+                return_exceptions=True,
+            )
+            for chat_id, res in zip(due_now, results):
+                if isinstance(res, Exception):
+                    LOG.error("Ping for chat_id=%s failed", chat_id, exc_info=res)
+            end_minute = dt.datetime.now(dt.timezone.utc).replace(second=0, microsecond=0)
+            ran_past = []
+            minute = max(this_minute, end_minute - NOTIFY_CATCHUP)
+            while minute < end_minute:
+                ran_past.append(minute)
+                minute += _MINUTE
+
+            if ran_past:
+                # The fan-out ran into a later minute: scan it (and backfill) right away.
+                continue
 
-            await asyncio.sleep(30)
+            # Sleep until the next due slot (or resync), unless the index changes first.
+            # Slots are looked up after this_minute, not now, so one that comes due
+            # while this pass finishes isn't skipped; never wake before it's over.
+            now_utc = dt.datetime.now(dt.timezone.utc)
+            next_at = _next_notify_at(this_minute)
+            delay = NOTIFY_RESYNC_SECONDS - (asyncio.get_running_loop().time() - loaded_at)
+            if next_at is not None:
+                delay = min(delay, (next_at - now_utc).total_seconds() + _CLOCK_PAD)
+            delay = max(delay, (this_minute + _MINUTE - now_utc).total_seconds() + _CLOCK_PAD)
+            try:
+                await asyncio.wait_for(_notify_changed.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
         except Exception:
             LOG.exception("notification_loop tick failed")
             await asyncio.sleep(5)
 
+# ----------------------------
+# Health endpoint (Fly http_service)
+# ----------------------------
+HEALTH_SERVER: Optional[asyncio.AbstractServer] = None
+HEALTH_READ_TIMEOUT = 5.0
+
+# Static probe reply, built once. asyncio already sets TCP_NODELAY on TCP transports.
+_HEALTH_RESP = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 2\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"ok"
+)
+
+async def _health_handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        # Consume the whole request head (not a fixed-size chunk) so close()
+        # doesn't reset the connection; stalled clients are dropped.
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEALTH_READ_TIMEOUT)
+        writer.write(_HEALTH_RESP)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+async def health_server_start():
+    global HEALTH_SERVER
+    port = int(os.getenv("PORT", "8080"))
+    HEALTH_SERVER = await asyncio.start_server(_health_handle, "0.0.0.0", port)
+    LOG.info("✅ Health endpoint on :%s", port)
+
 # ----------------------------
 # Boot
 # ----------------------------
+def _public_url() -> str:
+    return (os.getenv("PUBLIC_URL") or "").strip().rstrip("/")
+
 async def post_init(app: Application):
     await db_init()
+    if not _public_url():
+        # In webhook mode PTB's own server owns $PORT.
+        await health_server_start()
+    async with DB_POOL.acquire() as conn:
+        rows = await conn.fetch("SELECT DISTINCT tz FROM users")
+    await _warm_zones([_default_tz()] + [r["tz"] for r in rows if r["tz"]])
     app.create_task(notification_loop(app))
     LOG.info("🚀 Daycue boot %s", VERSION)
 
+# Plain text, not a /command; shared by every text-state and the menu fallback.
+TEXT_FILTER = filters.TEXT & ~filters.COMMAND
+# Exact menu-button texts (set membership, no regex).
+MENU_FILTER = filters.Text(MENU_TEXTS)
+
 def build_app() -> Application:
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
@@ -760,12 +1151,15 @@ def build_app() -> Application:
     conv = ConversationHandler(
         entry_points=[CommandHandler("start", cmd_start)],
         states={
-            O_NICK: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_nick)],
-            O_DOB: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_dob)],
-            O_START: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_start)],
-            O_END: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_end)],
-            O_CYCLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_cycle)],
-            O_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, o_time)],
+            state: [MessageHandler(MENU_FILTER, _finish_first(state)), MessageHandler(TEXT_FILTER, step)]
+            for state, step in (
+                (O_NICK, o_nick),
+                (O_DOB, o_dob),
+                (O_START, o_start),
+                (O_END, o_end),
+                (O_CYCLE, o_cycle),
+                (O_TIME, o_time),
+            )
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
@@ -783,13 +1177,25 @@ def build_app() -> Application:
     app.add_handler(CommandHandler("pause", cmd_pause))
     app.add_handler(CommandHandler("resume", cmd_resume))
 
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_menu_text))
+    app.add_handler(MessageHandler(TEXT_FILTER, on_menu_text))
     return app
 
 def main():
     logging.basicConfig(level=logging.INFO)
     app = build_app()
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    public_url = _public_url()
+    if public_url:
+        token = app.bot.token
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.getenv("PORT", "8080")),
+            url_path=token,
+            webhook_url=f"{public_url}/{token}",
+            secret_token=os.getenv("WEBHOOK_SECRET") or None,
+            allowed_updates=[Update.MESSAGE],
+        )
+    else:
+        app.run_polling(allowed_updates=[Update.MESSAGE])
 
 if __name__ == "__main__":
     main()